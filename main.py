@@ -1,21 +1,30 @@
 #!/usr/bin/env python3
 
-import json
+import ctypes
+import fcntl
+import heapq
 import os
+import queue
 import random
+import select
+import selectors
+import shutil
 import signal
 import sqlite3
+import struct
 import subprocess
 import sys
 import threading
 import time
 import traceback
+from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from pathlib import Path
 from typing import Any
 
-import requests
+import orjson
 from dotenv import load_dotenv
-from prometheus_client import Enum, Gauge, Info, start_http_server
+from prometheus_client import Counter, Enum, Gauge, Histogram, Info, start_http_server
 
 # Load environment variables from .env file if present
 _ = load_dotenv()
@@ -26,11 +35,54 @@ INPUT_DIR = os.environ.get("INPUT_DIR", "in_test")
 JELLYFIN_URL = os.environ.get("JELLYFIN_URL", "http://jellyfin:8096")
 # Jellyfin API key
 JELLYFIN_API = os.environ.get("JELLYFIN_API", "")
+# Seconds to wait for Jellyfin before giving up on a request
+JELLYFIN_TIMEOUT = float(os.environ.get("JELLYFIN_TIMEOUT", "30"))
+# Refresh Jellyfin once no transcode has finished for this many seconds, so a
+# burst of finished files costs one library scan instead of one per file
+JELLYFIN_DEBOUNCE_SECONDS = float(os.environ.get("JELLYFIN_DEBOUNCE_SECONDS", "30"))
+# Timeout for the last refresh on shutdown (docker stop only waits 10s by default)
+JELLYFIN_SHUTDOWN_TIMEOUT = 3.0
+# Reused across updates, so the keep-alive connection outlives a single call
+_jellyfin_session: Any = None
+# Debounced library refresh: the timer is restarted by every finished transcode
+_jellyfin_timer: threading.Timer | None = None
+_jellyfin_refresh_pending = False
+_jellyfin_lock = threading.Lock()
 # Prometheus metrics port
 METRICS_PORT = int(os.environ.get("METRICS_PORT", "9100"))
 # Render device for VAAPI
 VAAPI_RENDER_DEVICE = os.environ.get("VAAPI_RENDER_DEVICE", "/dev/dri/renderD128")
+# Comma-separated render devices to spread concurrent transcodes over
+VAAPI_RENDER_DEVICES = [
+    device.strip()
+    for device in os.environ.get("VAAPI_RENDER_DEVICES", VAAPI_RENDER_DEVICE).split(",")
+    if device.strip()
+]
+# Transcodes to run at the same time
+MAX_CONCURRENT_TRANSCODES = max(
+    1, int(os.environ.get("MAX_CONCURRENT_TRANSCODES", "1"))
+)
+# Don't start another concurrent transcode while the 1-minute load average is
+# above this much per CPU (0 = no limit); one transcode always runs
+MAX_LOAD_PER_CPU = float(os.environ.get("MAX_LOAD_PER_CPU", "0.9"))
+# ffmpeg threads per transcode (0 = ffmpeg decides); by default concurrent
+# transcodes share the cores out instead of each starting one thread per core
+FFMPEG_THREADS = max(
+    0,
+    int(
+        os.environ.get(
+            "FFMPEG_THREADS",
+            str(max(1, (os.cpu_count() or 1) // MAX_CONCURRENT_TRANSCODES))
+            if MAX_CONCURRENT_TRANSCODES > 1
+            else "0",
+        )
+    ),
+)
+# Decode and overlay on the GPU (needs a driver that can decode the source codec)
+VAAPI_HW_DECODE = os.environ.get("VAAPI_HW_DECODE", "0") == "1"
 DB_PATH = Path(os.environ.get("DB_PATH", "tracker.sqlite3")).expanduser()
+# How to notice new files: "auto" (inotify unless on a network FS), "inotify" or "poll"
+WATCH_MODE = os.environ.get("WATCH_MODE", "auto").lower()
 TEXT_BASED_SUBTITLE_CODECS = {
     "subrip",
     "srt",
@@ -39,20 +91,70 @@ TEXT_BASED_SUBTITLE_CODECS = {
     "ssa",
     "text",
 }
-SKIP_REASON_TEXT = "text_subtitles_present"
-SCAN_REASON_TRANSCODE = "requires_transcode"
+# Cached ffprobe outcomes, keyed by file signature
+PROBE_RESULT_SKIP_TEXT = "skip_text"
+PROBE_RESULT_NON_TEXT = "has_non_text"
+PROBE_RESULT_NO_SUBS = "no_subs"
+# Rows of the transcodes table
+TRANSCODE_STATE_RUNNING = "transcoding"
+TRANSCODE_STATE_DONE = "done"
+# Outputs smaller than this are leftovers of a failed run
+MIN_TRANSCODE_BYTES = 100
 
 ENDING = " - Transcoded"
 ENDING_ORG = " - Original"
 TARGET_FROMAT = "mkv"
 ALLOWED_EXTENSIONS = ["mp4", "mkv"]
 DISALLOWED_ENDINGS = [ENDING]
+_ALLOWED_EXT_SET = frozenset(ext.lower() for ext in ALLOWED_EXTENSIONS)
+_DISALLOWED_ENDINGS_TUPLE = tuple(DISALLOWED_ENDINGS)
+# Extensions a transcoded output may have (current target plus older runs)
+_TRANSCODED_EXTS = tuple(dict.fromkeys([TARGET_FROMAT, *ALLOWED_EXTENSIONS]))
+_TRANSCODED_SUFFIX = f"{ENDING}.{TARGET_FROMAT}"
 
 
 SUBTITLE_LIMIT = 3
 # Subtitles to remove
 REMOVE_SUBTITLES = ["sing", "song"]
-
+# Preferred subtitle order by language tag; everything else sorts last
+LANGUAGE_RANK = {"eng": 0, "und": 1}
+
+
+# Absolute paths let subprocess use posix_spawn instead of fork+exec
+FFMPEG_BIN = shutil.which("ffmpeg") or "ffmpeg"
+FFPROBE_BIN = shutil.which("ffprobe") or "ffprobe"
+
+# Niceness for ffmpeg, so the metrics server and watcher threads keep getting
+# CPU on a saturated box (0 leaves ffmpeg at our priority)
+FFMPEG_NICE = int(os.environ.get("FFMPEG_NICE", "10"))
+_NICE_BIN = shutil.which("nice")
+_IONICE_BIN = shutil.which("ionice")
+# Both exec the command in place, so the pid (and process group) stays ffmpeg's;
+# preexec_fn would also work but isn't safe once threads are running
+FFMPEG_PRIORITY_PREFIX: list[str] = []
+if FFMPEG_NICE > 0:
+    if _IONICE_BIN:
+        # Lowest best-effort I/O priority; -t: run anyway if it can't be set
+        FFMPEG_PRIORITY_PREFIX += [_IONICE_BIN, "-t", "-c", "2", "-n", "7"]
+    if _NICE_BIN:
+        FFMPEG_PRIORITY_PREFIX += [_NICE_BIN, "-n", str(FFMPEG_NICE)]
+# Give each concurrent transcode its own share of the CPUs, so they don't
+# thrash each other's caches (only with MAX_CONCURRENT_TRANSCODES > 1)
+FFMPEG_PIN_CPUS = os.environ.get("FFMPEG_PIN_CPUS", "0") == "1"
+_TASKSET_BIN = shutil.which("taskset")
+
+# With inotify, how often to re-walk the whole library anyway (catches deletions)
+RESCAN_INTERVAL_SECONDS = int(os.environ.get("RESCAN_INTERVAL_SECONDS", "3600"))
+
+# Directories listed in parallel during a full walk (1 = serial); rotational
+# disks always walk serially, where parallel listing would only add seeks
+SCAN_WORKERS = int(os.environ.get("SCAN_WORKERS", "4"))
+# "fiemap": walk directories in on-disk order (ext4 on spinning disks); implies
+# a serial walk
+SCAN_ORDER = os.environ.get("SCAN_ORDER", "").lower()
+
+# Parallel ffprobe runs while scanning (probing is mostly waiting on disk)
+PROBE_WORKERS = int(os.environ.get("PROBE_WORKERS", str(min(8, os.cpu_count() or 1))))
 
 MAX_TRANSCODE_DURATION_SECONDS = int(
     os.environ.get("MAX_TRANSCODE_DURATION_SECONDS", str(10 * 60 * 60))
@@ -77,6 +179,27 @@ current_state = Enum(
     states=["idle", "processing"],
 )
 current_file = Info("transcode_current_file", "File currently being processed")
+# Finished transcodes, by how many subtitle tracks were burned in (that decides
+# the filter path, and with it the cost)
+transcode_seconds = Histogram(
+    "transcode_seconds",
+    "Wall time of successful transcodes",
+    ["subtitles"],
+    buckets=(30, 60, 120, 300, 600, 1800, 3600, 7200, 14400),
+)
+transcode_output_bytes = Counter(
+    "transcode_output_bytes", "Bytes written by successful transcodes", ["subtitles"]
+)
+# Per transcode slot, so concurrent jobs don't overwrite each other
+transcode_out_time_seconds = Gauge(
+    "transcode_out_time_seconds", "Output position of the current transcode", ["slot"]
+)
+transcode_fps = Gauge(
+    "transcode_fps", "Frames per second of the current transcode", ["slot"]
+)
+transcode_speed = Gauge(
+    "transcode_speed", "Speed of the current transcode relative to realtime", ["slot"]
+)
 
 # Metrics readiness tracking
 metrics_ready = threading.Event()
@@ -84,13 +207,53 @@ metrics_server_started = False
 
 # Shutdown coordination
 shutdown_event = threading.Event()
-current_ffmpeg_process = None
+# Wakes the idle main loop: watcher events, SIGHUP, a finished transcode or shutdown
+wakeup_event = threading.Event()
+# Running ffmpeg processes by pid, so shutdown can stop every one of them
+current_ffmpeg_processes: dict[int, subprocess.Popen[bytes]] = {}
+_ffmpeg_lock = threading.Lock()
+# Files handed to a transcode worker and not finished yet
+in_flight: set[Path] = set()
+_in_flight_lock = threading.Lock()
+
+# inotify state: (path, exists) events from the watcher and the pending work set
+file_events: queue.Queue[tuple[Path, bool]] = queue.Queue()
+pending_files: set[Path] = set()
+file_watcher: "InotifyWatcher | None" = None
+# Files counted by the last full walk, so watcher events can update the gauges
+known_files: set[Path] = set()
+skipped_paths: set[Path] = set()
+# Set on SIGHUP or inotify overflow; the periodic walk reconciles missed changes
+rescan_requested = threading.Event()
+_next_full_scan = 0.0
 _DB_INIT_LOCK = threading.Lock()
 _DB_INITIALIZED = False
+# Stored in PRAGMA user_version. Migrations are additive: a v1 database gets
+# the new probe_cache columns via ALTER TABLE and keeps its rows; only an
+# unversioned one has its old tables dropped
+_DB_SCHEMA_VERSION = 2
+# One long-lived connection per thread; writes are serialized on top of that
+_conn_tls = threading.local()
+_DB_WRITE_LOCK = threading.Lock()
+# SQLite's default SQLITE_MAX_VARIABLE_NUMBER on older builds
+_SQLITE_MAX_PARAMS = 999
+_probe_pool: ThreadPoolExecutor | None = None
+# Polling without inotify: directory -> (mtime_ns, subdirs, candidate files,
+# name index) from the last pass, so unchanged directories aren't listed again
+_DirListing = tuple[int, list[str], list[str], dict[str, os.DirEntry[str]]]
+_dir_listings: dict[str, _DirListing] = {}
+# Listings younger than this aren't kept: on filesystems with coarse timestamps
+# a second change within the same tick would leave the mtime as it was
+_RACY_MTIME_NS = 2_000_000_000
+# Parsed ffprobe subtitle streams per path, tagged with (size, mtime_ns).
+# Insertion order doubles as recency order for evicting the oldest entry.
+_stream_cache: dict[str, tuple[tuple[int, int], list[dict[str, Any]]]] = {}
+_STREAM_CACHE_SIZE = 10_000
+_STREAM_CACHE_LOCK = threading.Lock()  # Probes run on the probe pool
 
 
 def init_skip_db() -> None:
-    """Initialize (if needed) the SQLite DB that tracks skipped files."""
+    """Initialize (if needed) the SQLite DB that caches ffprobe outcomes."""
     global _DB_INITIALIZED
     if _DB_INITIALIZED:
         return
@@ -103,16 +266,40 @@ def init_skip_db() -> None:
         try:
             conn = sqlite3.connect(str(DB_PATH), timeout=30)
             conn.execute("PRAGMA journal_mode=WAL;")
+            version: int = conn.execute("PRAGMA user_version;").fetchone()[0]
+            if version < 1:
+                # Skip decisions now come from probe_cache
+                conn.execute("DROP TABLE IF EXISTS skipped_transcodes")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS probe_cache (
+                    file_path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    result TEXT NOT NULL,
+                    codecs TEXT,
+                    streams BLOB
+                )
+                """
+            )
+            if version == 1:
+                # v2 keeps the parsed ffprobe streams (JSON) next to the outcome
+                conn.execute("ALTER TABLE probe_cache ADD COLUMN streams BLOB")
+            # Transcodes this daemon started, so startup cleanup needs no full walk
             conn.execute(
                 """
-                CREATE TABLE IF NOT EXISTS skipped_transcodes (
+                CREATE TABLE IF NOT EXISTS transcodes (
                     file_path TEXT PRIMARY KEY,
-                    reason TEXT NOT NULL,
-                    metadata TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    out_path TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    out_size INTEGER,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
                 """
             )
+            conn.execute(f"PRAGMA user_version={_DB_SCHEMA_VERSION};")
+            conn.commit()
+            conn.close()
         except Exception as exc:
             print("Failed to initialize skip DB:", exc)
             print("Removing potentially corrupt DB file.")
@@ -123,58 +310,138 @@ def init_skip_db() -> None:
 
             raise
         finally:
-        _DB_INITIALIZED = True
+            _DB_INITIALIZED = True
 
 
 def get_db_connection() -> sqlite3.Connection:
+    """Return this thread's cached connection, opening it on first use."""
+    conn: sqlite3.Connection | None = getattr(_conn_tls, "conn", None)
+    if conn is not None:
+        return conn
     init_skip_db()
-    return sqlite3.connect(str(DB_PATH), timeout=30)
+    conn = sqlite3.connect(str(DB_PATH), timeout=30)
+    # Per-connection settings; journal_mode=WAL is persisted by init_skip_db
+    conn.execute("PRAGMA busy_timeout=5000;")
+    conn.execute("PRAGMA synchronous=NORMAL;")  # Safe under WAL
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute("PRAGMA cache_size=-8000;")  # ~8 MB page cache
+    _conn_tls.conn = conn
+    return conn
 
 
-def record_file_decision(
-    file_path: Path, reason: str, metadata: dict[str, Any]
+def clear_skip_records() -> None:
+    with _DB_WRITE_LOCK, get_db_connection() as conn:
+        conn.execute("DELETE FROM probe_cache")
+
+
+def record_probe_result(
+    file_path: Path,
+    signature: tuple[int, int],
+    result: str,
+    codecs: list[str],
+    streams: list[dict[str, Any]] | None = None,
 ) -> None:
-    payload = json.dumps(metadata, separators=(",", ":"), sort_keys=True)
-    with get_db_connection() as conn:
+    """Remember the outcome of an ffprobe run so unchanged files are not reprobed."""
+    with _DB_WRITE_LOCK, get_db_connection() as conn:
         conn.execute(
             """
-            INSERT INTO skipped_transcodes (file_path, reason, metadata, created_at)
-            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            INSERT INTO probe_cache (file_path, size, mtime_ns, result, codecs, streams)
+            VALUES (?, ?, ?, ?, ?, ?)
             ON CONFLICT(file_path) DO UPDATE SET
-                reason=excluded.reason,
-                metadata=excluded.metadata,
-                created_at=CURRENT_TIMESTAMP
+                size=excluded.size,
+                mtime_ns=excluded.mtime_ns,
+                result=excluded.result,
+                codecs=excluded.codecs,
+                streams=excluded.streams
             """,
-            (str(file_path), reason, payload),
+            (
+                str(file_path),
+                *signature,
+                result,
+                ",".join(codecs),
+                orjson.dumps(streams) if streams is not None else None,
+            ),
         )
 
 
-def load_skip_record(file_path: Path) -> dict[str, Any] | None:
+def load_probe_result(file_path: Path) -> dict[str, Any] | None:
     with get_db_connection() as conn:
         row = conn.execute(
-            "SELECT reason, metadata FROM skipped_transcodes WHERE file_path = ?",
+            "SELECT size, mtime_ns, result, codecs, streams FROM probe_cache"
+            " WHERE file_path = ?",
             (str(file_path),),
         ).fetchone()
     if not row:
         return None
-    try:
-        metadata = json.loads(row[1]) if row[1] else {}
-    except json.JSONDecodeError:  # pragma: no cover - defensive
-        metadata = {}
-    return {"reason": row[0], "metadata": metadata}
-
-
-def delete_skip_record(file_path: Path) -> None:
-    with get_db_connection() as conn:
+    return {
+        "signature": (row[0], row[1]),
+        "result": row[2],
+        "codecs": row[3].split(",") if row[3] else [],
+        "streams": orjson.loads(row[4]) if row[4] is not None else None,
+    }
+
+
+def load_probe_results_bulk(paths: list[Path]) -> dict[str, dict[str, Any]]:
+    """Fetch cached probe results for many files with one SELECT per chunk."""
+    results: dict[str, dict[str, Any]] = {}
+    keys = [str(path) for path in paths]
+    conn = get_db_connection()
+    for start in range(0, len(keys), _SQLITE_MAX_PARAMS):
+        chunk = keys[start : start + _SQLITE_MAX_PARAMS]
+        placeholders = ", ".join("?" * len(chunk))
+        rows = conn.execute(
+            "SELECT file_path, size, mtime_ns, result, codecs FROM probe_cache"
+            f" WHERE file_path IN ({placeholders})",
+            chunk,
+        ).fetchall()
+        for row in rows:
+            results[row[0]] = {
+                "signature": (row[1], row[2]),
+                "result": row[3],
+                "codecs": row[4].split(",") if row[4] else [],
+            }
+    return results
+
+
+def record_transcode(
+    file_path: Path, out_path: Path, state: str, out_size: int | None = None
+) -> None:
+    """Remember that a transcode of ``file_path`` started or finished."""
+    with _DB_WRITE_LOCK, get_db_connection() as conn:
         conn.execute(
-            "DELETE FROM skipped_transcodes WHERE file_path = ?",
-            (str(file_path),),
+            """
+            INSERT INTO transcodes (file_path, out_path, state, out_size, updated_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(file_path) DO UPDATE SET
+                out_path=excluded.out_path,
+                state=excluded.state,
+                out_size=excluded.out_size,
+                updated_at=CURRENT_TIMESTAMP
+            """,
+            (str(file_path), str(out_path), state, out_size),
         )
 
 
-def clear_skip_records() -> None:
-    with get_db_connection() as conn:
-        conn.execute("DELETE FROM skipped_transcodes")
+def delete_transcode_record(file_path: Path) -> None:
+    with _DB_WRITE_LOCK, get_db_connection() as conn:
+        conn.execute("DELETE FROM transcodes WHERE file_path = ?", (str(file_path),))
+
+
+def load_suspect_transcodes() -> list[tuple[Path, Path, str]] | None:
+    """Return (source, output, state) for unfinished or tiny transcodes.
+
+    None means nothing has been recorded yet, so the index cannot vouch for
+    outputs written before it existed.
+    """
+    conn = get_db_connection()
+    if conn.execute("SELECT 1 FROM transcodes LIMIT 1").fetchone() is None:
+        return None
+    rows = conn.execute(
+        "SELECT file_path, out_path, state FROM transcodes"
+        " WHERE state != ? OR out_size < ?",
+        (TRANSCODE_STATE_DONE, MIN_TRANSCODE_BYTES),
+    ).fetchall()
+    return [(Path(row[0]), Path(row[1]), row[2]) for row in rows]
 
 
 def ensure_metrics_server_started() -> None:
@@ -191,16 +458,47 @@ def ensure_metrics_server_started() -> None:
 def probe_subtitle_streams(
     file_path: str, verbose: bool = False
 ) -> list[dict[str, Any]]:
+    """Return the subtitle streams of a file, reusing the last probe if unchanged."""
+    try:
+        stat = os.stat(file_path)
+        signature: tuple[int, int] | None = (stat.st_size, stat.st_mtime_ns)
+    except OSError:
+        signature = None
+    with _STREAM_CACHE_LOCK:
+        cached = _stream_cache.pop(file_path, None)
+        if signature is not None and cached is not None and cached[0] == signature:
+            _stream_cache[file_path] = cached  # Mark as most recently used
+        else:
+            cached = None
+    if cached is not None:
+        if verbose:
+            print(f"Using cached subtitle streams for {file_path}")
+        return cached[1]
+
+    # Survives restarts: the scan stored the streams along with its verdict
+    stored = load_probe_result(Path(file_path))
+    if (
+        signature is not None
+        and stored is not None
+        and stored["signature"] == signature
+        and stored["streams"] is not None
+    ):
+        if verbose:
+            print(f"Using stored subtitle streams for {file_path}")
+        _remember_streams(file_path, signature, stored["streams"])
+        return stored["streams"]
+
     command = [
-        "ffprobe",
+        FFPROBE_BIN,
         "-v",
         "error",
         "-print_format",
         "json",
+        # Stream headers are enough to list subtitle codecs
         "-analyzeduration",
-        "50G",
+        "1M",
         "-probesize",
-        "50M",
+        "1M",
         "-select_streams",
         "s",
         "-show_entries",
@@ -211,43 +509,57 @@ def probe_subtitle_streams(
         print(" ".join(command))
     else:
         print(f"ffprobe subtitles (quiet): {file_path}")
-    result = subprocess.run(command, capture_output=True, text=True, check=True)
+    # No stdin: ffprobe must never wait on (or eat) the terminal's input
+    result = subprocess.run(
+        command, stdin=subprocess.DEVNULL, capture_output=True, check=True
+    )
     out = result.stdout.strip()
-    if not out:
-        return []
-    data = json.loads(out)
+    data = orjson.loads(out) if out else {}
     if verbose:
         print("FFprobe stream info:")
-        print(json.dumps(data, indent=4))
-    return data.get("streams", [])
-
-
-def file_signature(file_path: Path) -> dict[str, int]:
-    stat = file_path.stat()
-    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
-
-
-def _matches_signature(metadata: dict[str, Any], signature: dict[str, int]) -> bool:
-    return (
-        metadata.get("size") == signature["size"]
-        and metadata.get("mtime_ns") == signature["mtime_ns"]
-    )
+        print(orjson.dumps(data, option=orjson.OPT_INDENT_2).decode())
+    streams: list[dict[str, Any]] = data.get("streams", [])
+    if signature is not None:
+        _remember_streams(file_path, signature, streams)
+    return streams
 
 
-def should_skip_due_to_text_subtitles(file_path: Path) -> bool:
+def _remember_streams(
+    file_path: str, signature: tuple[int, int], streams: list[dict[str, Any]]
+) -> None:
+    with _STREAM_CACHE_LOCK:
+        if len(_stream_cache) >= _STREAM_CACHE_SIZE:
+            del _stream_cache[next(iter(_stream_cache))]
+        _stream_cache[file_path] = (signature, streams)
+
+
+def file_signature(
+    file_path: Path, stat: os.stat_result | None = None
+) -> tuple[int, int]:
+    """Return (size, mtime_ns), using a stat result from the scan when available."""
+    if stat is None:
+        stat = file_path.stat()
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def should_skip_due_to_text_subtitles(
+    file_path: Path,
+    probe_results: dict[str, dict[str, Any]] | None = None,
+    stat: os.stat_result | None = None,
+) -> bool:
+    """Decide whether a file can be skipped; `probe_results` is a bulk-loaded cache."""
     try:
-        signature = file_signature(file_path)
+        signature = file_signature(file_path, stat)
     except FileNotFoundError:
         return False
 
-    record = load_skip_record(file_path)
-    cached_meta = (record or {}).get("metadata", {})
-    cached_reason = (record or {}).get("reason")
-    if cached_meta and _matches_signature(cached_meta, signature):
-        if cached_reason == SKIP_REASON_TEXT:
-            return True
-        if cached_reason == SCAN_REASON_TRANSCODE:
-            return False
+    # Unchanged files reuse the previous probe outcome without spawning ffprobe
+    if probe_results is None:
+        cached = load_probe_result(file_path)
+    else:
+        cached = probe_results.get(str(file_path))
+    if cached and cached["signature"] == signature:
+        return cached["result"] == PROBE_RESULT_SKIP_TEXT
 
     try:
         streams = probe_subtitle_streams(str(file_path))
@@ -256,7 +568,7 @@ def should_skip_due_to_text_subtitles(file_path: Path) -> bool:
         return False
 
     if not streams:
-        record_file_decision(file_path, SCAN_REASON_TRANSCODE, signature)
+        record_probe_result(file_path, signature, PROBE_RESULT_NO_SUBS, [], streams)
         return False
 
     text_codecs: list[str] = []
@@ -268,19 +580,18 @@ def should_skip_due_to_text_subtitles(file_path: Path) -> bool:
         else:
             non_text = True
 
+    codecs = sorted(set(text_codecs))
     if text_codecs and not non_text:
-        metadata: dict[str, Any] = {**signature, "codecs": sorted(set(text_codecs))}
-        record_file_decision(file_path, SKIP_REASON_TEXT, metadata)
-        pretty_codecs = ", ".join(metadata["codecs"])
+        record_probe_result(
+            file_path, signature, PROBE_RESULT_SKIP_TEXT, codecs, streams
+        )
+        pretty_codecs = ", ".join(codecs)
         print(
             f"Skipping transcode for {file_path.name}: detected browser-readable subtitles ({pretty_codecs})."
         )
         return True
 
-    metadata: dict[str, Any] = {**signature}
-    if text_codecs:
-        metadata["codecs"] = sorted(set(text_codecs))
-    record_file_decision(file_path, SCAN_REASON_TRANSCODE, metadata)
+    record_probe_result(file_path, signature, PROBE_RESULT_NON_TEXT, codecs, streams)
     return False
 
 
@@ -288,26 +599,69 @@ def handle_shutdown(signum, frame) -> None:  # pyright: ignore[reportUnknownPara
     """Signal handler for graceful shutdown (SIGINT/SIGTERM)."""
     print(f"Received signal {signum}, initiating graceful shutdown...")
     shutdown_event.set()
-    # Attempt to terminate ffmpeg process if running
-    global current_ffmpeg_process
-    if current_ffmpeg_process and current_ffmpeg_process.poll() is None:
+    wakeup_event.set()
+    # Attempt to terminate ffmpeg processes if running (no lock: we may have
+    # interrupted a thread holding it)
+    for process in list(current_ffmpeg_processes.values()):
+        if process.poll() is not None:
+            continue
         try:
-            print("Sending SIGTERM to ffmpeg process...")
-            current_ffmpeg_process.terminate()
+            print(f"Sending SIGTERM to ffmpeg process {process.pid}...")
+            process.terminate()
         except Exception as e:  # pragma: no cover - defensive
             print("Failed to terminate ffmpeg process:", e)
 
 
+def handle_rescan(signum, frame) -> None:  # pyright: ignore[reportUnknownParameterType]
+    """Signal handler (SIGHUP) that forces a full library walk on the next pass."""
+    print(f"Received signal {signum}, scheduling a full rescan...")
+    rescan_requested.set()
+    wakeup_event.set()
+
+
 def install_signal_handlers():
     _ = signal.signal(signal.SIGTERM, handle_shutdown)  # pyright: ignore[reportUnknownArgumentType]
     _ = signal.signal(signal.SIGINT, handle_shutdown)  # pyright: ignore[reportUnknownArgumentType]
+    _ = signal.signal(signal.SIGHUP, handle_rescan)  # pyright: ignore[reportUnknownArgumentType]
+
+
+def _sleep_or_exit(seconds: float, wake_on_work: bool = False) -> bool:
+    """Sleep for up to ``seconds``; return True at once if shutdown is requested.
+
+    With ``wake_on_work`` the sleep also ends early once ``wakeup_event`` is set.
+    """
+    if not wake_on_work:
+        return shutdown_event.wait(seconds)
+    _ = wakeup_event.wait(seconds)
+    return shutdown_event.is_set()
+
+
+def _load_too_high() -> bool:
+    """Whether the load average says another transcode would overload the host."""
+    if MAX_LOAD_PER_CPU <= 0:
+        return False
+    try:
+        load = os.getloadavg()[0]
+    except OSError:
+        return False
+    return load > MAX_LOAD_PER_CPU * (os.cpu_count() or 1)
+
+
+def _idle_timeout() -> float:
+    """How long the main loop may sleep when nothing new has been signalled."""
+    if file_watcher is None:
+        return 60
+    # The watcher wakes us for new files; still wake for the periodic full walk
+    # and now and then in case the watcher thread died
+    return min(300.0, max(1.0, _next_full_scan - time.monotonic()))
 
 
 def main():
-    # Check if VAAPI render device exists
-    if not Path(VAAPI_RENDER_DEVICE).exists():
-        print(f"VAAPI render device {VAAPI_RENDER_DEVICE} not found!")
-        sys.exit(1)
+    # Check if VAAPI render devices exist
+    for device in VAAPI_RENDER_DEVICES:
+        if not Path(device).exists():
+            print(f"VAAPI render device {device} not found!")
+            sys.exit(1)
 
     # Start Prometheus metrics server
     if METRICS_PORT > 0:
@@ -320,61 +674,107 @@ def main():
     install_signal_handlers()
 
     try:
-        _ = subprocess.run(["ffmpeg", "-version"], capture_output=False, text=True)
+        # One spawn answers both: whether ffmpeg runs and whether this build
+        # can encode on the GPU (otherwise every file would fail in turn)
+        encoders = subprocess.run(
+            [FFMPEG_BIN, "-hide_banner", "-encoders"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=False,
+        ).stdout
     except FileNotFoundError:
         print("FFmpeg not found!")
         sys.exit(1)
+    if b" hevc_vaapi " not in encoders:
+        print("FFmpeg was built without the hevc_vaapi encoder!")
+        sys.exit(1)
 
     init_skip_db()
 
     # Setup metrics
     current_state.state("idle")
 
+    global file_watcher
+    file_watcher = start_file_watcher()
+
     # Clean up any bad transcodes on startup
     try:
         cleanup_bad_transcodes()
     except Exception:
         print("Failed to cleanup bad transcodes on startup.")
 
-    while not shutdown_event.is_set():
-        processed_file = process_new()
-        if processed_file:
-            # Update Jellyfin
-            if JELLYFIN_API != "":
-                print("Updating Jellyfin libraries...")
-                try:
-                    update_all_libraries(JELLYFIN_URL, JELLYFIN_API)
-                except Exception as e:
-                    print("Failed to update Jellyfin libraries.", e)
-            # Short sleep if a file was processed
-            for _ in range(10):  # interruptible sleep (10 * 0.1 = 1s)
-                if shutdown_event.is_set():
+    # Running transcodes and the slot (render device, metrics label) each one holds
+    jobs: dict[Future[bool], tuple[Path, int]] = {}
+    with ThreadPoolExecutor(
+        max_workers=MAX_CONCURRENT_TRANSCODES, thread_name_prefix="transcode"
+    ) as pool:
+        while not shutdown_event.is_set():
+            # Cleared before looking, so anything arriving from here on wakes the next wait
+            wakeup_event.clear()
+            free_slots = sorted(
+                set(range(MAX_CONCURRENT_TRANSCODES)) - {s for _, s in jobs.values()}
+            )
+            if jobs and free_slots and _load_too_high():
+                # Keep what's running, but don't pile more onto a busy host
+                free_slots = []
+            for file_path, slot in zip(process_new(len(free_slots)), free_slots):
+                with _in_flight_lock:
+                    in_flight.add(file_path)
+                future = pool.submit(process_file, file_path, slot)
+                future.add_done_callback(lambda _: wakeup_event.set())
+                jobs[future] = (file_path, slot)
+
+            if len(jobs) == MAX_CONCURRENT_TRANSCODES:
+                # With every slot busy there is nothing to do until a job finishes
+                # (returns on shutdown, since handle_shutdown stops every ffmpeg)
+                done, _ = wait(jobs, return_when=FIRST_COMPLETED)
+            else:
+                # Sleep until the watcher reports a file, a job finishes or the
+                # next poll / full walk is due
+                timeout = _idle_timeout()
+                if not jobs:
+                    print(
+                        f"No files to process. Sleeping for up to {timeout:.0f} seconds..."
+                    )
+                    current_state.state("idle")
+                if _sleep_or_exit(timeout, wake_on_work=True):
                     break
-                time.sleep(0.1)
-        else:
-            # Interruptible longer sleep (60s)
-            print("No files to process. Sleeping for 60 seconds...")
-            current_state.state("idle")
-            for _ in range(600):  # 600 * 0.1 = 60s
-                if shutdown_event.is_set():
+                done = {future for future in jobs if future.done()}
+            for future in done:
+                file_path, _slot = jobs.pop(future)
+                # A failed file stays pending: it's still counted as to process,
+                # and deleting its partial output mustn't count as a lost transcode
+                if future.result():
+                    pending_files.discard(file_path)
+            if done:
+                schedule_jellyfin_refresh()
+                # Short sleep if a file was processed
+                if _sleep_or_exit(1):
                     break
-                time.sleep(0.1)
 
-    # Final cleanup before exit
-    print("Shutdown requested. Cleaning up...")
+        # Final cleanup before exit
+        print("Shutdown requested. Cleaning up...")
+        # Leaving the pool waits for the workers; their ffmpeg loops see the shutdown
+
+    # Don't let a debounced refresh die with the process
+    flush_jellyfin_refresh()
     current_state.state("idle")
     current_file.info({"file": ""})
 
-    # Ensure ffmpeg process is terminated if still running
-    global current_ffmpeg_process
-    if current_ffmpeg_process and current_ffmpeg_process.poll() is None:
+    # Ensure ffmpeg processes are terminated if still running
+    with _ffmpeg_lock:
+        leftover = list(current_ffmpeg_processes.values())
+    for process in leftover:
+        if process.poll() is not None:
+            continue
         try:
             print("Terminating ffmpeg process during shutdown...")
-            current_ffmpeg_process.terminate()
-            current_ffmpeg_process.wait(timeout=10)
+            process.terminate()
+            _ = process.wait(timeout=10)
         except subprocess.TimeoutExpired:
             print("FFmpeg did not exit after SIGTERM, killing...")
-            current_ffmpeg_process.kill()
+            process.kill()
         except Exception as e:  # pragma: no cover - defensive
             print("Error terminating ffmpeg during shutdown:", e)
 
@@ -382,28 +782,115 @@ def main():
 
 
 # Main loop
-def process_new() -> bool:
-    # Get all files that need to be processed
-    all = get_all_files()
-    to_process, skipped_files = remove_files_if_procesed(all)
-
-    # Update metrics
-    total_files.set(len(all))
-    total_files_to_process.set(len(to_process))
-    total_files_skipped.set(len(skipped_files))
-    processed_count = len(all) - len(to_process) - len(skipped_files)
-    total_files_transcoded.set(processed_count)
+def process_new(slots: int = 1) -> list[Path]:
+    """Refresh the pending set and pick up to ``slots`` files to transcode next."""
+    global pending_files, known_files, skipped_paths, _next_full_scan
+    full_scan_due = rescan_requested.is_set() or time.monotonic() >= _next_full_scan
+    if file_watcher is None or full_scan_due:
+        # Walk: every pass when polling, else first pass, periodically or on request
+        if full_scan_due:
+            rescan_requested.clear()
+            _next_full_scan = time.monotonic() + RESCAN_INTERVAL_SECONDS
+            _dir_listings.clear()
+        # The walk's listings answer "is there a transcode next to it" as well
+        dir_cache: dict[Path, dict[str, os.DirEntry[str]]] = {}
+        if file_watcher is None:
+            stats = scan_changed_dirs(dir_cache)
+        else:
+            stats = scan_input_files(dir_cache)
+        all = list(stats)
+        to_process, skipped_files = remove_files_if_procesed(all, stats, dir_cache)
+        known_files = set(all)
+        skipped_paths = set(skipped_files)
+
+        # Update metrics
+        total_files.set(len(all))
+        total_files_skipped.set(len(skipped_files))
+        processed_count = len(all) - len(to_process) - len(skipped_files)
+        total_files_transcoded.set(processed_count)
+    else:
+        # Only re-check the pending set plus whatever the watcher reported
+        while True:
+            try:
+                path, exists = file_events.get_nowait()
+            except queue.Empty:
+                break
+            if not exists:
+                forget_path(path)
+                continue
+            pending_files.add(path)
+            if path not in known_files:
+                known_files.add(path)
+                total_files.inc()
+        stats: dict[Path, os.stat_result] = {}
+        # A set has no useful order; group by directory so each one is listed
+        # and probed in one go (full walks already yield a directory at a time)
+        for path in sorted(pending_files, key=lambda p: (p.parent, p.name)):
+            try:
+                stats[path] = path.stat()
+            except FileNotFoundError:
+                continue
+        to_process, skipped_files = remove_files_if_procesed(list(stats), stats)
+        for path in skipped_files:
+            if path not in skipped_paths:
+                skipped_paths.add(path)
+                total_files_skipped.inc()
+    pending_files = set(to_process)
+    total_files_to_process.set(len(pending_files))
 
     metrics_ready.set()
     ensure_metrics_server_started()
 
-    if len(to_process) >= 1 and not shutdown_event.is_set():
-        print(f"Found {len(to_process)} files to process.")
-        random_file = random.Random().choice(to_process)
-        print(f"Picking random file: {random_file}")
-        process_file(random_file)
-        return True
-    return False
+    with _in_flight_lock:
+        waiting = [path for path in to_process if path not in in_flight]
+    if waiting and slots > 0 and not shutdown_event.is_set():
+        print(f"Found {len(waiting)} files to process.")
+        picked = random.sample(waiting, min(slots, len(waiting)))
+        for random_file in picked:
+            print(f"Picking random file: {random_file}")
+        return picked
+    return []
+
+
+def forget_path(path: Path) -> None:
+    """Apply a deletion reported by the watcher to the pending set and gauges."""
+    if _is_transcoded_name(path.name):
+        # A transcode disappeared, so its source needs processing again
+        source_name = path.name.rpartition(".")[0].removesuffix(ENDING)
+        try:
+            names = os.listdir(path.parent)
+        except OSError:
+            return
+        for name in names:
+            stem = name.rpartition(".")[0].removesuffix(ENDING_ORG)
+            source = path.parent / name
+            if stem != source_name or not _is_candidate_name(name):
+                continue
+            # A failed run deletes its partial output while the source is still
+            # pending; only a source counted as transcoded lost anything
+            if source in pending_files or source in skipped_paths:
+                continue
+            if source in known_files:
+                total_files_transcoded.dec()
+            pending_files.add(source)
+            total_files_to_process.inc()
+        return
+
+    if path in known_files:
+        removed = [path]
+    else:
+        # A whole directory went away (or was moved out of the tree)
+        prefix = f"{path}{os.sep}"
+        removed = [known for known in known_files if str(known).startswith(prefix)]
+    for known in removed:
+        known_files.discard(known)
+        total_files.dec()
+        if known in skipped_paths:
+            skipped_paths.discard(known)
+            total_files_skipped.dec()
+        elif known not in pending_files:
+            total_files_transcoded.dec()
+        pending_files.discard(known)
 
 
 # Execute ffmpeg
@@ -411,35 +898,54 @@ def run_ffmpeg_vaapi(
     input_path: str,
     output_path: str,
     subtitle_limit: int = SUBTITLE_LIMIT,
-):
+    slot: int = 0,
+) -> int:
+    """Transcode one file; returns how many subtitle tracks were burned in."""
     filters: list[str] = []
     maps: list[str] = []
 
+    streams: list[str] = []
     if subtitle_limit > 0:
         streams = get_stream_info(input_path)
         streams = streams[:subtitle_limit]  # Limit number of subtitles
         print("Subtitle streams found:", streams)
-        # Split
-        # filters.append(
-        #     f"[0:v]split={len(streams)}{''.join(f'[split{i}]' for i in range(len(streams)))}"
-        # )
+
+    if streams:
+        # Decode once and fan the frames out; every subtitle gets its own video track
+        branches = "".join(f"[base{i}]" for i in range(len(streams)))
+        filters.append(f"[0:v]split={len(streams)}{branches}")
         for i, sub_index in enumerate(streams):
-            chain = (
-                f"[0:v][0:{sub_index}]overlay[burned_{i}];"
-                f"[burned_{i}]format=nv12,hwupload[v_out{i}]"
-            )
+            if VAAPI_HW_DECODE:
+                # Frames stay on the GPU; only the subtitle bitmaps are uploaded
+                chain = (
+                    f"[0:{sub_index}]format=yuva420p,hwupload[sub_{i}];"
+                    f"[base{i}][sub_{i}]overlay_vaapi[v_out{i}]"
+                )
+            else:
+                chain = (
+                    f"[base{i}][0:{sub_index}]overlay[burned_{i}];"
+                    f"[burned_{i}]format=nv12,hwupload[v_out{i}]"
+                )
             filters.append(chain)
             maps.extend(["-map", f"[v_out{i}]"])
+    elif VAAPI_HW_DECODE:
+        # Nothing to burn in; convert on the GPU instead of falling back to swscale
+        filters.append("[0:v]scale_vaapi=format=nv12[v_out0]")
+        maps.extend(["-map", "[v_out0]"])
     else:
-        # No subtitles? Just pass the hardware stream through
-        maps.extend(["-map", "0:v"])
+        # Nothing to burn in, but the encoder still needs VAAPI frames
+        filters.append("[0:v]format=nv12,hwupload[v_out0]")
+        maps.extend(["-map", "[v_out0]"])
 
     # Combine filters
-    filter_complex: list[str] = (
-        ["-filter_complex", ";".join(filters)] if filters else []
-    )
+    filter_complex: list[str] = ["-filter_complex", ";".join(filters)]
     print("Filter complex:", filter_complex)
 
+    # Decode on the GPU too, so frames never leave VAAPI memory
+    hw_decode: list[str] = (
+        ["-hwaccel", "vaapi", "-hwaccel_device", "va"] if VAAPI_HW_DECODE else []
+    )
+
     # Figure out compression_level
     def compression_level() -> int:  # type: ignore
         vbaq = 16
@@ -453,7 +959,7 @@ def run_ffmpeg_vaapi(
         return level
 
     command = [
-        "ffmpeg",
+        FFMPEG_BIN,
         "-hide_banner",  # suppress banner
         "-stats_period",
         "5",  # Only show stats periodically
@@ -465,17 +971,16 @@ def run_ffmpeg_vaapi(
         "-probesize",
         "20M",  # increase probe size
         "-init_hw_device",
-        f"vaapi=va:{VAAPI_RENDER_DEVICE}",  # Initialize VAAPI device
-        # "-hwaccel",
-        # "vaapi",  # Use VAAPI hardware acceleration for decoding
-        # "-hwaccel_device",
-        # "va", # Use VAAPI device for filters
+        # Initialize VAAPI device; concurrent jobs round-robin over the devices
+        f"vaapi=va:{VAAPI_RENDER_DEVICES[slot % len(VAAPI_RENDER_DEVICES)]}",
+        *hw_decode,  # Optional VAAPI hardware decoding
         "-hwaccel_output_format",
         "vaapi",  # Use VAAPI for hwaccel output
+        *_thread_limits(),  # Per-job thread cap (decoder and filter graph)
         "-i",
         input_path,
-        # "-filter_hw_device",
-        # "va",  # Use VAAPI device for filters
+        "-filter_hw_device",
+        "va",  # Use VAAPI device for filters
         *filter_complex,  # Add filters
         *maps,  # video map
         "-map",
@@ -501,61 +1006,152 @@ def run_ffmpeg_vaapi(
     ]
     print(" ".join(command))
     # ffmpeg_filtergraph(command)
-    start_ffmpeg_process(command)
+    start_ffmpeg_process(command, slot=slot)
+    return len(streams)
+
+
+def _thread_limits() -> list[str]:
+    """ffmpeg options capping the decoder and filter threads at FFMPEG_THREADS.
+
+    Placed before -i: -threads there applies to the decoder, while the filter
+    options are global. The hevc_vaapi encode runs on the GPU.
+    """
+    if not FFMPEG_THREADS:
+        return []
+    threads = str(FFMPEG_THREADS)
+    return [
+        "-threads",
+        threads,
+        "-filter_threads",
+        threads,
+        "-filter_complex_threads",
+        threads,
+    ]
+
+
+def _cpu_pin_prefix(slot: int) -> list[str]:
+    """taskset prefix pinning the ffmpeg in `slot` to a disjoint set of CPUs."""
+    if not FFMPEG_PIN_CPUS or MAX_CONCURRENT_TRANSCODES < 2 or _TASKSET_BIN is None:
+        return []
+    # The CPUs we may use, not all of the host's (containers, cgroups)
+    cpus = sorted(os.sched_getaffinity(0))
+    share = max(1, len(cpus) // MAX_CONCURRENT_TRANSCODES)
+    start = slot * share % len(cpus)
+    return [_TASKSET_BIN, "-c", ",".join(map(str, cpus[start : start + share]))]
 
 
 def start_ffmpeg_process(
     command: list[str],
     termination_timeout: int = 15,
+    slot: int = 0,
 ) -> None:
     """Start ffmpeg process and handle graceful shutdown."""
-    global current_ffmpeg_process
-    # Start ffmpeg in a new process group so we can terminate the whole group if needed
-    current_ffmpeg_process = subprocess.Popen(
-        command,
-        text=True,
-        start_new_session=True,
+    # Start ffmpeg in its own process group so we can terminate the whole group
+    process = subprocess.Popen(
+        [*_cpu_pin_prefix(slot), *FFMPEG_PRIORITY_PREFIX, *command],
+        # ffmpeg reads keyboard commands ("q", "?") from stdin; under a TTY or
+        # docker -i that input would go to (or stall) the transcode
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,  # -progress pipe:1
+        process_group=0,
         env={**os.environ, "LIBVA_DRIVER_NAME": "radeonsi"},
     )
+    with _ffmpeg_lock:
+        current_ffmpeg_processes[process.pid] = process
+    assert process.stdout is not None
+    progress_fd = process.stdout.fileno()
+    selector = selectors.DefaultSelector()
+    _ = selector.register(progress_fd, selectors.EVENT_READ)
+    partial = b""
+    progress: dict[str, str] = {}
     try:
         while True:
             if shutdown_event.is_set():
-                if current_ffmpeg_process.poll() is None:
+                if process.poll() is None:
                     print(
                         "Shutdown detected. Sending SIGTERM to ffmpeg process group..."
                     )
                     try:
                         # Send SIGTERM to the process group for all ffmpeg children
-                        os.killpg(current_ffmpeg_process.pid, signal.SIGTERM)
+                        os.killpg(process.pid, signal.SIGTERM)
                     except ProcessLookupError:
                         pass
-                    # Wait up to termination_timeout seconds
-                    waited = 0
-                    while waited < termination_timeout:
-                        if current_ffmpeg_process.poll() is not None:
-                            break
-                        time.sleep(1)
-                        waited += 1
-                    if current_ffmpeg_process.poll() is None:
+                    # Block in waitpid for up to termination_timeout seconds
+                    try:
+                        _ = process.wait(timeout=termination_timeout)
+                    except subprocess.TimeoutExpired:
                         print(
                             "FFmpeg did not exit after SIGTERM, sending SIGKILL to process group..."
                         )
                         try:
-                            os.killpg(current_ffmpeg_process.pid, signal.SIGKILL)
+                            os.killpg(process.pid, signal.SIGKILL)
                         except ProcessLookupError:
                             pass
+                        _ = process.wait()
                     raise InterruptedError("Transcode interrupted by shutdown")
                 break
 
-            ret = current_ffmpeg_process.poll()
-            if ret is not None:
+            # Wakes on progress output and on exit (ffmpeg closing the pipe)
+            if selector.select(timeout=1):
+                chunk = os.read(progress_fd, 1 << 16)
+                if not chunk:
+                    _ = process.wait()
+                    break
+                *lines, partial = (partial + chunk).split(b"\n")
+                for line in lines:
+                    key, _sep, value = line.partition(b"=")
+                    key = key.strip()
+                    if key == b"progress":  # Last key of every progress block
+                        report_progress(progress, slot)
+                        progress = {}
+                    elif key in _PROGRESS_KEYS:
+                        # Only the keys we report get decoded
+                        progress[key.decode()] = value.strip().decode(errors="replace")
+            elif process.poll() is not None:
                 break
-            time.sleep(1)
-        ret_code = current_ffmpeg_process.returncode
+        ret_code = process.returncode
         if ret_code != 0:
+            if shutdown_event.is_set():
+                # handle_shutdown stops ffmpeg itself, so the pipe usually hits
+                # EOF before the loop sees the flag; that's a stop, not a crash
+                raise InterruptedError("Transcode interrupted by shutdown")
             raise Exception(f"FFmpeg exited with non-zero status {ret_code}")
     finally:
-        current_ffmpeg_process = None
+        selector.close()
+        process.stdout.close()
+        transcode_out_time_seconds.labels(slot).set(0)
+        transcode_fps.labels(slot).set(0)
+        transcode_speed.labels(slot).set(0)
+        with _ffmpeg_lock:
+            _ = current_ffmpeg_processes.pop(process.pid, None)
+
+
+# -progress keys that end up in the metrics or the log line
+_PROGRESS_KEYS = frozenset({b"out_time_us", b"out_time", b"fps", b"speed"})
+
+
+def _progress_value(progress: dict[str, str], key: str) -> float | None:
+    try:
+        return float(progress.get(key, "").removesuffix("x"))
+    except ValueError:  # "N/A" before the first frame
+        return None
+
+
+def report_progress(progress: dict[str, str], slot: int = 0) -> None:
+    """Publish one ffmpeg -progress block as Prometheus gauges."""
+    out_time_us = _progress_value(progress, "out_time_us")
+    fps = _progress_value(progress, "fps")
+    speed = _progress_value(progress, "speed")
+    if out_time_us is not None and out_time_us >= 0:
+        transcode_out_time_seconds.labels(slot).set(out_time_us / 1_000_000)
+    if fps is not None:
+        transcode_fps.labels(slot).set(fps)
+    if speed is not None:
+        transcode_speed.labels(slot).set(speed)
+    print(
+        f"Progress [{slot}]: {progress.get('out_time', 'N/A')}"
+        f" fps={progress.get('fps', 'N/A')} speed={progress.get('speed', 'N/A')}"
+    )
 
 
 def ffmpeg_filtergraph(command: list[str]):
@@ -577,8 +1173,10 @@ def ffmpeg_filtergraph(command: list[str]):
             "debug",
             "pipe:1",
         ],
+        stdin=subprocess.DEVNULL,
         capture_output=True,
         text=True,
+        check=False,
     )
     if result.returncode != 0:
         raise Exception(f"FFmpeg filtergraph error: {result.stderr}")
@@ -586,10 +1184,22 @@ def ffmpeg_filtergraph(command: list[str]):
 
 
 def get_stream_info(file_path: str) -> list[str]:
+    # The scan already probed this file; if it found no subtitles at all,
+    # don't probe the (unchanged) container a second time just to hear it again
+    cached = load_probe_result(Path(file_path))
+    if (
+        cached
+        and cached["result"] == PROBE_RESULT_NO_SUBS
+        and cached["signature"] == file_signature(Path(file_path))
+    ):
+        print(f"No subtitle streams in {file_path} (cached probe)")
+        return []
+
     try:
         streams = probe_subtitle_streams(file_path, verbose=True)
     except subprocess.CalledProcessError as exc:  # pragma: no cover - ffprobe failure
-        raise Exception(f"FFprobe error: {exc.stderr}") from exc
+        stderr = exc.stderr.decode(errors="replace") if exc.stderr else exc
+        raise Exception(f"FFprobe error: {stderr}") from exc
 
     # keep only streams that don't contain unwanted tags
     streams = [
@@ -602,15 +1212,7 @@ def get_stream_info(file_path: str) -> list[str]:
     ]
 
     # sort directly on the JSON objects by language
-    streams.sort(
-        key=lambda s: (
-            0
-            if s.get("tags", {}).get("language") == "eng"
-            else 1
-            if s.get("tags", {}).get("language") == "und"
-            else 2
-        )
-    )
+    streams.sort(key=lambda s: LANGUAGE_RANK.get(s.get("tags", {}).get("language"), 2))
 
     result_streams: list[str] = []
     for stream in streams:
@@ -621,17 +1223,34 @@ def get_stream_info(file_path: str) -> list[str]:
     return result_streams
 
 
+def _show_in_flight() -> None:
+    """Mirror the files being transcoded into the state metrics."""
+    with _in_flight_lock:
+        names = sorted(path.name for path in in_flight)
+    current_state.state("processing" if names else "idle")
+    current_file.info({"file": ", ".join(names)})
+
+
 # Process a single file
-def process_file(file_path: Path):
-    current_state.state("processing")
-    current_file.info({"file": str(file_path.name)})
+def process_file(file_path: Path, slot: int = 0) -> bool:
+    """Transcode one file; returns whether the transcode was written."""
+    with _in_flight_lock:
+        in_flight.add(file_path)
+    _show_in_flight()
+    success = False
     try:
         dir_name = file_path.parent
-        name = file_path.stem.removesuffix(ENDING_ORG)
-        output_name = f"{name}{ENDING}.{TARGET_FROMAT}"
-        output_path = dir_name / output_name
+        output_path = dir_name / _output_name(file_path.stem)
         print("===================== Processing started ======================")
-        run_ffmpeg_vaapi(str(file_path), str(output_path))
+        record_transcode(file_path, output_path, TRANSCODE_STATE_RUNNING)
+        started = time.monotonic()
+        subtitles = run_ffmpeg_vaapi(str(file_path), str(output_path), slot=slot)
+        elapsed = time.monotonic() - started
+        out_size = output_path.stat().st_size
+        record_transcode(file_path, output_path, TRANSCODE_STATE_DONE, out_size)
+        transcode_seconds.labels(subtitles).observe(elapsed)
+        transcode_output_bytes.labels(subtitles).inc(out_size)
+        success = True
         print("===================== Finished processing =====================")
     except InterruptedError:
         print("Processing interrupted. Cleaning partial transcode...")
@@ -645,120 +1264,662 @@ def process_file(file_path: Path):
         print(f"Error processing file {file_path}:\n\t {e}")
         delete_transcode(file_path)
     finally:
-        # Adjust metrics only if we actually started a file (avoid negative values)
-        if total_files_to_process._value.get() > 0:  # type: ignore[attr-defined]
+        # A failed or interrupted file is still waiting to be transcoded
+        if success:
             total_files_to_process.dec()
-        total_files_transcoded.inc()
-        current_state.state("idle")
-        current_file.info({"file": ""})
-    current_state.state("idle")
+            total_files_transcoded.inc()
+        with _in_flight_lock:
+            in_flight.discard(file_path)
+        _show_in_flight()
+    return success
+
+
+def _is_candidate_name(name: str) -> bool:
+    stem, dot, ext = name.rpartition(".")
+    if not dot or ext.lower() not in _ALLOWED_EXT_SET:
+        return False
+    return not stem.endswith(_DISALLOWED_ENDINGS_TUPLE)
+
+
+def _output_name(stem: str) -> str:
+    """Name of the transcode written for a source file with this stem."""
+    return stem.removesuffix(ENDING_ORG) + _TRANSCODED_SUFFIX
+
+
+def _is_transcoded_name(name: str) -> bool:
+    stem, dot, ext = name.rpartition(".")
+    return bool(dot) and ext.lower() in _TRANSCODED_EXTS and stem.endswith(ENDING)
+
+
+def is_candidate_file(path: Path) -> bool:
+    """Check whether a path looks like an input file that may need transcoding."""
+    return _is_candidate_name(path.name)
+
+
+def _iter_input_files(
+    directory: str, dir_cache: dict[Path, dict[str, os.DirEntry[str]]] | None = None
+) -> Iterator[os.DirEntry[str]]:
+    """Walk `directory` once, yielding candidate files; unreadable dirs are skipped.
+
+    With `dir_cache`, every listing is kept in the shape `_dir_index` uses, so
+    later sibling lookups don't list the directory a second time. A listing is
+    only complete once the walk is done.
+    """
+    by_offset = SCAN_ORDER == "fiemap"
+    if SCAN_WORKERS > 1 and not by_offset and not _is_rotational(directory):
+        yield from _iter_input_files_parallel(directory, dir_cache)
+        return
+    # Explicit stack: no generator chain per directory level, no recursion limit.
+    # For SCAN_ORDER=fiemap it's a heap instead, so the disk head sweeps forward
+    # through the directories seen so far rather than seeking back and forth.
+    stack: list[tuple[int, str]] = [(0, directory)]
+    while stack:
+        _, current = heapq.heappop(stack) if by_offset else stack.pop()
+        try:
+            entries = os.scandir(current)
+        except OSError:
+            continue
+        index = (
+            dir_cache.setdefault(Path(current), {}) if dir_cache is not None else None
+        )
+        with entries:
+            for entry in entries:
+                if index is not None:
+                    index[entry.name] = entry
+                # Like rglob, don't descend into symlinked directories (and
+                # d_type alone answers this, no stat for symlinks)
+                if entry.is_dir(follow_symlinks=False):
+                    if by_offset:
+                        heapq.heappush(stack, (_fiemap_offset(entry.path), entry.path))
+                    else:
+                        stack.append((0, entry.path))
+                elif _is_candidate_name(entry.name) and entry.is_file():
+                    yield entry
+
+
+# FS_IOC_FIEMAP = _IOWR('f', 11, struct fiemap); the header is followed by room
+# for a single struct fiemap_extent
+_FS_IOC_FIEMAP = 0xC020660B
+_FIEMAP_HEADER = struct.Struct("=QQIIII")
+_FIEMAP_EXTENT_SIZE = 56
+
+
+def _fiemap_offset(path: str) -> int:
+    """Physical byte offset of the first extent of `path`, or 0 if unknown."""
+    request = bytearray(
+        _FIEMAP_HEADER.pack(0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0)
+        + bytes(_FIEMAP_EXTENT_SIZE)
+    )
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return 0
+    try:
+        _ = fcntl.ioctl(fd, _FS_IOC_FIEMAP, request)
+    except OSError:  # Not supported by this filesystem
+        return 0
+    finally:
+        os.close(fd)
+    mapped_extents = _FIEMAP_HEADER.unpack_from(request)[3]
+    if not mapped_extents:
+        return 0
+    # fe_logical comes first, fe_physical second
+    return struct.unpack_from("=Q", request, _FIEMAP_HEADER.size + 8)[0]
+
+
+def _list_dir(directory: str) -> tuple[str, list[os.DirEntry[str]] | None]:
+    try:
+        with os.scandir(directory) as entries:
+            return directory, list(entries)
+    except OSError:
+        return directory, None
+
+
+def _iter_input_files_parallel(
+    directory: str, dir_cache: dict[Path, dict[str, os.DirEntry[str]]] | None = None
+) -> Iterator[os.DirEntry[str]]:
+    """`_iter_input_files` with up to SCAN_WORKERS directory listings in flight."""
+    # Workers only run scandir (which drops the GIL while reading); the results
+    # are sorted out here, so dir_cache is only touched from this thread
+    with ThreadPoolExecutor(
+        max_workers=SCAN_WORKERS, thread_name_prefix="scan"
+    ) as pool:
+        running = {pool.submit(_list_dir, directory)}
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                current, entries = future.result()
+                if entries is None:
+                    continue
+                if dir_cache is not None:
+                    dir_cache[Path(current)] = {entry.name: entry for entry in entries}
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        running.add(pool.submit(_list_dir, entry.path))
+                    elif _is_candidate_name(entry.name) and entry.is_file():
+                        yield entry
+
+
+def _is_rotational(path: str) -> bool:
+    """Whether `path` lives on a spinning disk (unknown devices count as not)."""
+    try:
+        dev = os.stat(path).st_dev
+    except OSError:
+        return False
+    block = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+    # Partitions have no queue/ of their own; it lives on the parent disk
+    for queue_dir in (f"{block}/queue", f"{block}/../queue"):
+        try:
+            with open(f"{queue_dir}/rotational") as flag:
+                return flag.read().strip() == "1"
+        except OSError:
+            continue
+    return False
 
 
 # Scan "INPUT_DIR" for all files
 def get_all_files() -> list[Path]:
     input_dir = Path(INPUT_DIR).resolve()
-    input_files: list[Path] = []
-    for ext in ALLOWED_EXTENSIONS:
-        for file_path in input_dir.rglob(f"*.{ext}"):
-            name = file_path.stem
-            if not any(name.endswith(ending) for ending in DISALLOWED_ENDINGS):
-                input_files.append(file_path)
-    return input_files
+    return [Path(entry.path) for entry in _iter_input_files(str(input_dir))]
+
+
+def scan_input_files(
+    dir_cache: dict[Path, dict[str, os.DirEntry[str]]] | None = None,
+) -> dict[Path, os.stat_result]:
+    """Like get_all_files, but keep each file's stat so the scan can reuse it."""
+    input_dir = Path(INPUT_DIR).resolve()
+    stats: dict[Path, os.stat_result] = {}
+    for entry in _iter_input_files(str(input_dir), dir_cache):
+        try:
+            stats[Path(entry.path)] = entry.stat()
+        except FileNotFoundError:
+            continue
+    return stats
+
+
+def _poll_dir(
+    directory: str, cached: _DirListing | None
+) -> tuple[str, _DirListing | None, dict[str, os.stat_result]]:
+    """Re-list `directory` only if its mtime moved; always stat its candidates."""
+    try:
+        mtime = os.stat(directory).st_mtime_ns  # Before listing, so no change is lost
+    except OSError:
+        return directory, None, {}
+    listing = cached if cached is not None and cached[0] == mtime else None
+    if listing is None:
+        subdirs: list[str] = []
+        files: list[str] = []
+        index: dict[str, os.DirEntry[str]] = {}
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    index[entry.name] = entry
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif _is_candidate_name(entry.name) and entry.is_file():
+                        files.append(entry.path)
+        except OSError:
+            return directory, None, {}
+        listing = (mtime, subdirs, files, index)
+    # Writing into a file doesn't touch its directory, so sizes are always fresh
+    stats: dict[str, os.stat_result] = {}
+    for path in listing[2]:
+        try:
+            stats[path] = os.stat(path)
+        except FileNotFoundError:
+            continue
+    return directory, listing, stats
+
+
+def scan_changed_dirs(
+    dir_cache: dict[Path, dict[str, os.DirEntry[str]]],
+) -> dict[Path, os.stat_result]:
+    """Like scan_input_files, but unchanged directories cost a stat, not a listing."""
+    root = str(Path(INPUT_DIR).resolve())
+    fresh: dict[str, _DirListing] = {}
+    stats: dict[Path, os.stat_result] = {}
+    cutoff = time.time_ns() - _RACY_MTIME_NS
+
+    def collect(
+        directory: str,
+        listing: _DirListing | None,
+        file_stats: dict[str, os.stat_result],
+    ) -> list[str]:
+        if listing is None:
+            return []
+        if listing[0] < cutoff:
+            fresh[directory] = listing
+        dir_cache[Path(directory)] = listing[3]
+        for path, stat in file_stats.items():
+            stats[Path(path)] = stat
+        return listing[1]
+
+    if SCAN_WORKERS > 1 and not _is_rotational(root):
+        with ThreadPoolExecutor(
+            max_workers=SCAN_WORKERS, thread_name_prefix="scan"
+        ) as pool:
+            running = {pool.submit(_poll_dir, root, _dir_listings.get(root))}
+            while running:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for child in collect(*future.result()):
+                        running.add(
+                            pool.submit(_poll_dir, child, _dir_listings.get(child))
+                        )
+    else:
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            stack.extend(collect(*_poll_dir(directory, _dir_listings.get(directory))))
+    # Directories that disappeared drop out with the rest
+    _dir_listings.clear()
+    _dir_listings.update(fresh)
+    return stats
+
+
+def _dir_index(
+    cache: dict[Path, dict[str, os.DirEntry[str]]], directory: Path
+) -> dict[str, os.DirEntry[str]]:
+    """List `directory` once per cache; lookups then replace per-file stat calls."""
+    index = cache.get(directory)
+    if index is None:
+        try:
+            with os.scandir(directory) as entries:
+                index = {entry.name: entry for entry in entries}
+        except OSError:
+            index = {}
+        cache[directory] = index
+    return index
+
+
+def _with_siblings(
+    file_paths: list[Path], cache: dict[Path, dict[str, os.DirEntry[str]]]
+) -> Iterator[tuple[Path, str, dict[str, os.DirEntry[str]]]]:
+    """Yield each path with its stem and the listing of its directory.
+
+    Paths come grouped by directory, so the listing is only looked up when the
+    directory changes; the split works on the string instead of building
+    PurePath objects for .parent and .stem on every file.
+    """
+    last_dir: str | None = None
+    index: dict[str, os.DirEntry[str]] = {}
+    for file_path in file_paths:
+        dir_name, name = os.path.split(file_path)
+        if dir_name != last_dir:
+            last_dir = dir_name
+            index = _dir_index(cache, file_path.parent)
+        yield file_path, os.path.splitext(name)[0], index
 
 
 def get_all_transcoded_files(all_files: list[Path]) -> list[Path]:
     transcoded_files: list[Path] = []
-    for file_path in all_files:
-        dir_name = file_path.parent
-        name = file_path.stem.removesuffix(ENDING_ORG)
-        for ext in set([TARGET_FROMAT, *ALLOWED_EXTENSIONS]):
-            processed_name = f"{name}{ENDING}.{ext}"
-            processed_path = dir_name / processed_name
-            if processed_path.exists():
-                transcoded_files.append(processed_path)
+    dir_cache: dict[Path, dict[str, os.DirEntry[str]]] = {}
+    for file_path, stem, names in _with_siblings(all_files, dir_cache):
+        prefix = f"{stem.removesuffix(ENDING_ORG)}{ENDING}."
+        for ext in _TRANSCODED_EXTS:
+            processed_name = prefix + ext
+            if processed_name in names:
+                transcoded_files.append(file_path.with_name(processed_name))
     return transcoded_files
 
 
 # Remove files that have already been processed
-def remove_files_if_procesed(file_list: list[Path]) -> tuple[list[Path], list[Path]]:
+def remove_files_if_procesed(
+    file_list: list[Path],
+    stats: dict[Path, os.stat_result] | None = None,
+    dir_cache: dict[Path, dict[str, os.DirEntry[str]]] | None = None,
+) -> tuple[list[Path], list[Path]]:
     unprocessed_files: list[Path] = []
     skipped_files: list[Path] = []
-    for file_path in file_list:
-        dir_name = file_path.parent
-        name = file_path.stem.removesuffix(ENDING_ORG)
-        processed_name = f"{name}{ENDING}.{TARGET_FROMAT}"
-        processed_path = dir_name / processed_name
-        if processed_path.exists():
+    probe_results = load_probe_results_bulk(file_list)
+    if dir_cache is None:
+        dir_cache = {}
+    candidates: list[tuple[Path, os.stat_result | None]] = []
+    to_probe: list[tuple[Path, os.stat_result | None]] = []
+    with _in_flight_lock:
+        busy = set(in_flight)
+    for file_path, stem, siblings in _with_siblings(file_list, dir_cache):
+        if file_path in busy:
+            # Still transcoding; its partial output must not count as done
+            unprocessed_files.append(file_path)
+            continue
+        if _output_name(stem) in siblings:
             continue
 
+        stat = stats.get(file_path) if stats is not None else None
+        candidates.append((file_path, stat))
+        cached = probe_results.get(str(file_path))
+        if (
+            cached is None
+            or stat is None
+            or cached["signature"] != file_signature(file_path, stat)
+        ):
+            to_probe.append((file_path, stat))
+
+    def evaluate(candidate: tuple[Path, os.stat_result | None]) -> bool:
+        file_path, stat = candidate
         try:
-            if should_skip_due_to_text_subtitles(file_path):
-                skipped_files.append(file_path)
-                continue
+            return should_skip_due_to_text_subtitles(file_path, probe_results, stat)
         except Exception as exc:  # pragma: no cover - defensive logging
             print(f"Failed to evaluate subtitles for {file_path}: {exc}")
+            return False
 
-        unprocessed_files.append(file_path)
+    # Cache misses spawn ffprobe; overlap those, cache hits are decided inline
+    probed: dict[Path, bool] = {}
+    if to_probe:
+        for candidate, skip in zip(to_probe, get_probe_pool().map(evaluate, to_probe)):
+            probed[candidate[0]] = skip
+
+    for candidate in candidates:
+        file_path = candidate[0]
+        skip = probed[file_path] if file_path in probed else evaluate(candidate)
+        if skip:
+            skipped_files.append(file_path)
+        else:
+            unprocessed_files.append(file_path)
     return unprocessed_files, skipped_files
 
 
+def get_probe_pool() -> ThreadPoolExecutor:
+    """Shared pool for ffprobe runs; kept alive so workers reuse their DB connections."""
+    global _probe_pool
+    if _probe_pool is None:
+        _probe_pool = ThreadPoolExecutor(
+            max_workers=max(1, PROBE_WORKERS), thread_name_prefix="probe"
+        )
+    return _probe_pool
+
+
+# inotify constants from <sys/inotify.h>
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+# Finished writes, new (sub)directories, and files moved in, out or deleted
+_WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_MOVED_FROM
+# struct inotify_event: wd, mask, cookie, len (followed by the name)
+_INOTIFY_EVENT = struct.Struct("iIII")
+# inotify does not see changes made by other NFS/SMB clients
+_NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "fuse.sshfs", "9p"}
+
+
+class InotifyWatcher:
+    """Recursively watch a directory and queue (path, exists) events for media files.
+
+    Files are reported once complete (closed after writing or moved in) and again
+    when deleted or moved away; removed directories are reported as a whole.
+    """
+
+    def __init__(self, root: Path, file_queue: queue.Queue[tuple[Path, bool]]) -> None:
+        self.root = root
+        self.file_queue = file_queue
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._fd: int = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._watches: dict[int, Path] = {}
+
+    def start(self) -> None:
+        self._add_tree(self.root, enqueue=False)
+        thread = threading.Thread(target=self._run, name="inotify", daemon=True)
+        thread.start()
+
+    def _add_watch(self, directory: Path) -> None:
+        wd: int = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(directory), _WATCH_MASK
+        )
+        if wd < 0:
+            errno = ctypes.get_errno()
+            print(f"Failed to watch {directory}: {os.strerror(errno)}")
+            return
+        self._watches[wd] = directory
+
+    def _remove_tree(self, directory: Path) -> None:
+        # Watches follow the inode, so a moved-away tree would keep reporting
+        prefix = f"{directory}{os.sep}"
+        for wd, path in list(self._watches.items()):
+            if path == directory or str(path).startswith(prefix):
+                _ = self._libc.inotify_rm_watch(self._fd, wd)
+                del self._watches[wd]
+
+    def _add_tree(self, directory: Path, enqueue: bool) -> None:
+        for root, _, files in os.walk(directory):
+            root_path = Path(root)
+            self._add_watch(root_path)
+            if not enqueue:
+                continue
+            # Files that landed before the watch existed would otherwise be missed
+            for name in files:
+                path = root_path / name
+                if is_candidate_file(path):
+                    self.file_queue.put((path, True))
+
+    def _run(self) -> None:
+        try:
+            while not shutdown_event.is_set():
+                ready, _, _ = select.select([self._fd], [], [], 1.0)
+                if ready:
+                    self._read_events()
+                    if not self.file_queue.empty() or rescan_requested.is_set():
+                        wakeup_event.set()
+        except Exception:  # pragma: no cover - defensive
+            traceback.print_exc()
+            print("inotify watcher failed, falling back to full scans.")
+            global file_watcher
+            file_watcher = None
+        finally:
+            os.close(self._fd)
+
+    def _read_events(self) -> None:
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            self._handle_event(wd, mask, name)
+
+    def _handle_event(self, wd: int, mask: int, name: str) -> None:
+        if mask & _IN_Q_OVERFLOW:
+            print("inotify event queue overflowed, scheduling a full rescan.")
+            rescan_requested.set()
+            return
+        if mask & _IN_IGNORED:
+            _ = self._watches.pop(wd, None)
+            return
+        directory = self._watches.get(wd)
+        if directory is None or not name:
+            return
+        path = directory / name
+        if mask & (_IN_DELETE | _IN_MOVED_FROM):
+            if mask & _IN_ISDIR:
+                self._remove_tree(path)
+                self.file_queue.put((path, False))
+            elif is_candidate_file(path) or _is_transcoded_name(name):
+                self.file_queue.put((path, False))
+        elif mask & _IN_ISDIR:
+            self._add_tree(path, enqueue=True)
+        elif mask & (_IN_CLOSE_WRITE | _IN_MOVED_TO) and is_candidate_file(path):
+            self.file_queue.put((path, True))
+
+
+def _filesystem_type(path: Path) -> str | None:
+    """Return the filesystem type of the mount containing `path` (Linux only)."""
+    try:
+        mounts = Path("/proc/mounts").read_text()
+    except OSError:
+        return None
+    target = str(path)
+    best_mount, best_type = "", None
+    for line in mounts.splitlines():
+        parts = line.split()
+        if len(parts) < 3:
+            continue
+        mount_point = parts[1].replace("\\040", " ")
+        prefix = mount_point.rstrip("/") + "/"
+        if target != mount_point and not target.startswith(prefix):
+            continue
+        if len(mount_point) > len(best_mount):
+            best_mount, best_type = mount_point, parts[2]
+    return best_type
+
+
+def start_file_watcher() -> InotifyWatcher | None:
+    """Start the inotify watcher for INPUT_DIR, or return None to keep polling."""
+    if WATCH_MODE == "poll":
+        print("File watching disabled (WATCH_MODE=poll), scanning every cycle.")
+        return None
+    input_dir = Path(INPUT_DIR).resolve()
+    if WATCH_MODE == "auto":
+        fs_type = _filesystem_type(input_dir)
+        if fs_type in _NETWORK_FILESYSTEMS:
+            print(f"{input_dir} is on {fs_type}, falling back to polling.")
+            return None
+    try:
+        watcher = InotifyWatcher(input_dir, file_events)
+        watcher.start()
+    except (OSError, AttributeError) as exc:
+        # AttributeError: libc without inotify (non-Linux)
+        print(f"inotify unavailable ({exc}), falling back to polling.")
+        return None
+    print(f"Watching {input_dir} for new files with inotify.")
+    return watcher
+
+
 # Update jellyfin registries
-def update_all_libraries(jellyfin_url: str, api_key: str):
-    """Fetch all libraries from Jellyfin and trigger a scan for each."""
-    headers = {"X-Emby-Token": api_key}
+def _get_jellyfin_session(api_key: str) -> Any:
+    """The shared Jellyfin session, created on first use."""
+    global _jellyfin_session
+    if _jellyfin_session is None:
+        # Deferred: only needed with JELLYFIN_API set, and slow to import
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        session = requests.Session()
+        adapter = HTTPAdapter(max_retries=Retry(total=2, backoff_factor=0.2))
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _jellyfin_session = session
+    _jellyfin_session.headers["X-Emby-Token"] = api_key
+    return _jellyfin_session
+
+
+def update_all_libraries(
+    jellyfin_url: str,
+    api_key: str,
+    timeout: float = JELLYFIN_TIMEOUT,
+    retry: bool = True,
+):
+    """Trigger a scan of every Jellyfin library with a single request."""
+    url = f"{jellyfin_url}/Library/Refresh"
+    if retry:
+        resp = _get_jellyfin_session(api_key).post(url, timeout=timeout)
+    else:
+        import requests
+
+        # The default adapter makes a single attempt
+        resp = requests.post(url, headers={"X-Emby-Token": api_key}, timeout=timeout)
+    resp.raise_for_status()
+    print("Library scan triggered.")
+
 
-    # Fetch libraries
+def _refresh_jellyfin(timeout: float = JELLYFIN_TIMEOUT, retry: bool = True) -> None:
+    global _jellyfin_refresh_pending
+    with _jellyfin_lock:
+        if not _jellyfin_refresh_pending:
+            return
+        _jellyfin_refresh_pending = False
+    print("Updating Jellyfin libraries...")
     try:
-        resp = requests.get(f"{jellyfin_url}/Library/VirtualFolders", headers=headers)
-        resp.raise_for_status()
-        libraries = resp.json()  # pyright: ignore[reportAny]
+        update_all_libraries(JELLYFIN_URL, JELLYFIN_API, timeout, retry)
     except Exception as e:
-        print(f"Failed to fetch libraries: {e}")
-        return
+        print("Failed to update Jellyfin libraries.", e)
+
 
-    if not libraries:
-        print("No libraries found.")
+def schedule_jellyfin_refresh() -> None:
+    """(Re)start the debounce timer after a transcode finished."""
+    global _jellyfin_timer, _jellyfin_refresh_pending
+    if JELLYFIN_API == "":
         return
+    with _jellyfin_lock:
+        if _jellyfin_timer is not None:
+            _jellyfin_timer.cancel()
+        _jellyfin_refresh_pending = True
+        _jellyfin_timer = threading.Timer(JELLYFIN_DEBOUNCE_SECONDS, _refresh_jellyfin)
+        _jellyfin_timer.daemon = True
+        _jellyfin_timer.start()
 
-    # Trigger a scan for each library
-    for lib in libraries:  # pyright: ignore[reportAny]
-        lib_id = lib.get("ItemId")  # pyright: ignore[reportAny]
-        lib_name = lib.get("Name", "Unknown")  # pyright: ignore[reportAny]
-        if not lib_id:
-            print(f"Skipping library {lib_name} (no ID)")
-            continue
 
-        print(f"Starting scan for library '{lib_name}' (ID: {lib_id})...")
-        try:
-            scan_url = (
-                f"{jellyfin_url}/Items/{lib_id}/Refresh"
-                "?Recursive=true&ImageRefreshMode=Default&MetadataRefreshMode=Default"
-                "&ReplaceAllImages=false&RegenerateTrickplay=false&ReplaceAllMetadata=false"
-            )
-            _ = requests.post(scan_url, headers=headers)
-            print(f"Scan triggered for '{lib_name}'.")
-        except Exception as e:
-            print(f"Failed to scan library {lib_name}: {e}")
+def flush_jellyfin_refresh() -> None:
+    """Send a still pending refresh now instead of waiting out the timer.
+
+    Runs during shutdown, so it makes one short attempt: a slow Jellyfin
+    mustn't hold the exit past the container's stop grace period.
+    """
+    with _jellyfin_lock:
+        if _jellyfin_timer is not None:
+            _jellyfin_timer.cancel()
+    _refresh_jellyfin(JELLYFIN_SHUTDOWN_TIMEOUT, retry=False)
 
 
 def delete_transcode(file: Path):
     dir_name = file.parent
-    name = file.stem.removesuffix(ENDING_ORG)
-    processed_name = f"{name}{ENDING}.{TARGET_FROMAT}"
-    processed_path = dir_name / processed_name
+    processed_path = dir_name / _output_name(file.stem)
     if processed_path.exists():
         processed_path.unlink()
         print(f"Deleted transcoded file: {processed_path}")
+    delete_transcode_record(file)
 
 
 def cleanup_bad_transcodes():
-    all_files = get_all_files()
-    for file_path in all_files:
-        dir_name = file_path.parent
-        name = file_path.stem.removesuffix(ENDING_ORG)
-        processed_name = f"{name}{ENDING}.{TARGET_FROMAT}"
-        processed_path = dir_name / processed_name
-        if processed_path.exists() and processed_path.stat().st_size < 100:
+    suspects = load_suspect_transcodes()
+    if suspects is None:
+        cleanup_bad_transcodes_by_walk()
+        return
+    # Only transcodes the index can't vouch for: a crash mid-encode leaves a
+    # "transcoding" row behind, failed runs leave a tiny output
+    for file_path, processed_path, state in suspects:
+        try:
+            size = processed_path.stat().st_size
+        except FileNotFoundError:
+            delete_transcode_record(file_path)
+            continue
+        if state == TRANSCODE_STATE_RUNNING:
+            print(f"Deleting interrupted transcode: {processed_path}")
+        elif size < MIN_TRANSCODE_BYTES:
+            print(f"Deleting bad transcode because its empty: {processed_path}")
+        else:
+            continue
+        processed_path.unlink()
+        delete_transcode_record(file_path)
+
+
+def cleanup_bad_transcodes_by_walk():
+    """Check every source for a tiny transcode next to it (the pre-index way)."""
+    input_dir = Path(INPUT_DIR).resolve()
+    # One listing per directory serves both the walk and the sibling lookups
+    dir_cache: dict[Path, dict[str, os.DirEntry[str]]] = {}
+    sources = [
+        Path(entry.path) for entry in _iter_input_files(str(input_dir), dir_cache)
+    ]
+    for file_path, stem, siblings in _with_siblings(sources, dir_cache):
+        processed_name = _output_name(stem)
+        entry = siblings.get(processed_name)
+        if (
+            entry is not None
+            and entry.stat(follow_symlinks=False).st_size < MIN_TRANSCODE_BYTES
+        ):
+            processed_path = file_path.with_name(processed_name)
             print(f"Deleting bad transcode because its empty: {processed_path}")
             processed_path.unlink()
 
@@ -766,7 +1927,7 @@ def cleanup_bad_transcodes():
 def probe_duration_seconds(file_path: Path) -> float | None:
     """Return the media duration in seconds using ffprobe."""
     command = [
-        "ffprobe",
+        FFPROBE_BIN,
         "-v",
         "error",
         "-show_entries",
@@ -776,15 +1937,21 @@ def probe_duration_seconds(file_path: Path) -> float | None:
         str(file_path),
     ]
     try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
+        result = subprocess.run(
+            command, stdin=subprocess.DEVNULL, capture_output=True, check=True
+        )
     except subprocess.CalledProcessError as exc:
-        print(f"Failed to probe duration for {file_path}: {exc.stderr or exc}")
+        stderr = exc.stderr.decode(errors="replace") if exc.stderr else exc
+        print(f"Failed to probe duration for {file_path}: {stderr}")
         return None
+    # float() takes the bytes as they are; decode only for the error message
     raw = result.stdout.strip()
     try:
         return float(raw)
     except ValueError:
-        print(f"Unable to parse duration for {file_path}: '{raw}'")
+        print(
+            f"Unable to parse duration for {file_path}: '{raw.decode(errors='replace')}'"
+        )
         return 60 * 60 * 999  # 999 hours
 
 
@@ -853,7 +2020,7 @@ if __name__ == "__main__":
         print("Deletion complete.")
         sys.exit(0)
     if len(sys.argv) > 1 and sys.argv[1] == "clear-db":
-        print("This will remove all skip-tracking records.")
+        print("This will remove all probe-cache records.")
         print(f"Database path: {DB_PATH}")
         print("Press y to continue...")
         confirmation = input().strip().lower()
@@ -861,7 +2028,7 @@ if __name__ == "__main__":
             print("Aborting DB clear.")
             sys.exit(0)
         clear_skip_records()
-        print("Skip-tracking table cleared.")
+        print("Probe cache cleared.")
         sys.exit(0)
     # main.py list
     if len(sys.argv) > 1 and sys.argv[1] == "list":
@@ -881,7 +2048,7 @@ if __name__ == "__main__":
     print("Input Directory:", INPUT_DIR)
     print("Run `main.py delete` to delete all transcoded files.")
     print("Run `main.py list` to list all transcoded files.")
-    print("Run `main.py clear-db` to remove skip-tracking metadata.")
+    print("Run `main.py clear-db` to clear the probe cache.")
     print(
         "Run `main.py clean` to remove transcoded files longer than"
         f" {MAX_TRANSCODE_DURATION_SECONDS / 3600:.0f} hours."
@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# main.py is a script, not a package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Point main at a fresh database file; yields its path."""
+    path = tmp_path / "tracker.sqlite3"
+    monkeypatch.setattr(main, "DB_PATH", path)
+    monkeypatch.setattr(main, "_DB_INITIALIZED", False)
+    # Connections are cached per thread; don't reuse one to another test's DB
+    conn = getattr(main._conn_tls, "conn", None)
+    if conn is not None:
+        conn.close()
+        del main._conn_tls.conn
+    yield path
+    conn = getattr(main._conn_tls, "conn", None)
+    if conn is not None:
+        conn.close()
+        del main._conn_tls.conn
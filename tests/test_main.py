@@ -0,0 +1,300 @@
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+import main
+
+
+def gauge(metric) -> float:
+    return metric._value.get()
+
+
+# --- naming --------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    ("stem", "expected"),
+    [
+        ("Movie", "Movie - Transcoded.mkv"),
+        ("Movie - Original", "Movie - Transcoded.mkv"),
+        ("Show.S01E01", "Show.S01E01 - Transcoded.mkv"),
+    ],
+)
+def test_output_name(stem, expected):
+    assert main._output_name(stem) == expected
+
+
+@pytest.mark.parametrize(
+    ("name", "expected"),
+    [
+        ("Movie - Transcoded.mkv", True),
+        ("Movie - Transcoded.MP4", True),  # Older runs kept the source extension
+        ("Movie - Transcoded", False),
+        ("Movie.mkv", False),
+        ("Movie - Original.mkv", False),
+        ("Movie - Transcoded.srt", False),
+    ],
+)
+def test_is_transcoded_name(name, expected):
+    assert main._is_transcoded_name(name) is expected
+
+
+def test_output_name_is_never_a_candidate():
+    output = main._output_name("Movie")
+    assert main._is_transcoded_name(output)
+    assert not main._is_candidate_name(output)
+
+
+def test_with_siblings_splits_paths_and_reuses_listings(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    files = [
+        tmp_path / "a" / "x.y.mkv",
+        tmp_path / "a" / "z.mp4",
+        tmp_path / "b" / "w.mkv",
+    ]
+    for path in files:
+        path.touch()
+    cache: dict[Path, dict] = {}
+    result = list(main._with_siblings(files, cache))
+    assert [(path, stem) for path, stem, _ in result] == [
+        (files[0], "x.y"),
+        (files[1], "z"),
+        (files[2], "w"),
+    ]
+    assert set(result[0][2]) == {"x.y.mkv", "z.mp4"}
+    assert result[0][2] is result[1][2]
+    assert set(cache) == {tmp_path / "a", tmp_path / "b"}
+
+
+# --- probe cache ---------------------------------------------------------
+
+
+@pytest.fixture
+def probes(monkeypatch):
+    """Stub ffprobe; returns the list of probed paths."""
+    calls: list[str] = []
+    streams = [{"index": 2, "codec_name": "subrip"}]
+
+    def probe(file_path, *args, **kwargs):
+        calls.append(file_path)
+        return streams
+
+    monkeypatch.setattr(main, "probe_subtitle_streams", probe)
+    return calls
+
+
+def test_unchanged_file_reuses_cached_probe(db, tmp_path, probes):
+    video = tmp_path / "Movie.mkv"
+    video.write_bytes(b"video")
+
+    assert main.should_skip_due_to_text_subtitles(video) is True
+    assert main.should_skip_due_to_text_subtitles(video) is True
+    assert probes == [str(video)]
+
+
+def test_changed_file_is_reprobed(db, tmp_path, probes):
+    video = tmp_path / "Movie.mkv"
+    video.write_bytes(b"video")
+    assert main.should_skip_due_to_text_subtitles(video) is True
+
+    video.write_bytes(b"re-encoded video")
+    assert main.should_skip_due_to_text_subtitles(video) is True
+    assert probes == [str(video), str(video)]
+
+
+# --- schema migration ----------------------------------------------------
+
+
+def _tables(path: Path) -> set[str]:
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        return {row[0] for row in rows}
+    finally:
+        conn.close()
+
+
+def _user_version(path: Path) -> int:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_unversioned_database_drops_skip_table(db):
+    conn = sqlite3.connect(db)
+    conn.execute(
+        """
+        CREATE TABLE skipped_transcodes (
+            file_path TEXT PRIMARY KEY, reason TEXT NOT NULL, metadata TEXT,
+            created_at TIMESTAMP
+        )
+        """
+    )
+    conn.commit()
+    conn.close()
+    main.init_skip_db()
+
+    assert _user_version(db) == main._DB_SCHEMA_VERSION
+    assert "skipped_transcodes" not in _tables(db)
+    assert "probe_cache" in _tables(db)
+
+
+def _make_v1_db(path: Path) -> None:
+    conn = sqlite3.connect(path)
+    conn.execute(
+        """
+        CREATE TABLE probe_cache (
+            file_path TEXT PRIMARY KEY, size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL, result TEXT NOT NULL, codecs TEXT
+        )
+        """
+    )
+    conn.execute(
+        "INSERT INTO probe_cache VALUES ('/in/a.mkv', 10, 20, ?, 'srt')",
+        (main.PROBE_RESULT_SKIP_TEXT,),
+    )
+    conn.execute("PRAGMA user_version=1")
+    conn.commit()
+    conn.close()
+
+
+def test_v1_database_is_migrated_and_keeps_probe_results(db):
+    _make_v1_db(db)
+    main.init_skip_db()
+
+    assert _user_version(db) == main._DB_SCHEMA_VERSION
+    assert _tables(db) == {"probe_cache", "transcodes"}
+    cached = main.load_probe_result(Path("/in/a.mkv"))
+    assert cached == {
+        "signature": (10, 20),
+        "result": main.PROBE_RESULT_SKIP_TEXT,
+        "codecs": ["srt"],
+        "streams": None,
+    }
+
+
+def test_migrated_database_stores_streams(db):
+    _make_v1_db(db)
+    streams = [{"index": 2, "codec_name": "subrip"}]
+    main.record_probe_result(
+        Path("/in/b.mkv"), (1, 2), main.PROBE_RESULT_SKIP_TEXT, ["subrip"], streams
+    )
+    assert main.load_probe_result(Path("/in/b.mkv"))["streams"] == streams
+
+
+def test_migration_is_idempotent(db):
+    _make_v1_db(db)
+    main.init_skip_db()
+    main._DB_INITIALIZED = False
+    main.init_skip_db()
+    assert _user_version(db) == main._DB_SCHEMA_VERSION
+    assert main.load_probe_result(Path("/in/a.mkv")) is not None
+
+
+# --- watcher deletions ---------------------------------------------------
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    """A source with a finished transcode, counted like a full walk would."""
+    source = tmp_path / "Movie.mkv"
+    source.touch()
+    monkeypatch.setattr(main, "known_files", {source})
+    monkeypatch.setattr(main, "pending_files", set())
+    monkeypatch.setattr(main, "skipped_paths", set())
+    main.total_files.set(1)
+    main.total_files_to_process.set(0)
+    main.total_files_transcoded.set(1)
+    main.total_files_skipped.set(0)
+    return source
+
+
+def test_deleted_transcode_requeues_its_source(library):
+    main.forget_path(library.with_name("Movie - Transcoded.mkv"))
+
+    assert main.pending_files == {library}
+    assert gauge(main.total_files_transcoded) == 0
+    assert gauge(main.total_files_to_process) == 1
+
+
+def test_failed_runs_partial_output_is_not_a_lost_transcode(library):
+    # A failed run leaves the source pending and counted as to process
+    main.pending_files.add(library)
+    main.total_files_to_process.set(1)
+    main.total_files_transcoded.set(0)
+
+    main.forget_path(library.with_name("Movie - Transcoded.mkv"))
+
+    assert main.pending_files == {library}
+    assert gauge(main.total_files_transcoded) == 0
+    assert gauge(main.total_files_to_process) == 1
+
+
+def test_deleted_transcode_of_skipped_source_is_ignored(library):
+    main.skipped_paths.add(library)
+    main.total_files_skipped.set(1)
+    main.total_files_transcoded.set(0)
+
+    main.forget_path(library.with_name("Movie - Transcoded.mkv"))
+
+    assert main.pending_files == set()
+    assert gauge(main.total_files_transcoded) == 0
+
+
+def test_deleted_source_is_forgotten(library):
+    library.unlink()
+    main.forget_path(library)
+
+    assert main.known_files == set()
+    assert gauge(main.total_files) == 0
+    assert gauge(main.total_files_transcoded) == 0
+
+
+def test_deleted_directory_forgets_everything_below_it(tmp_path, library):
+    season = tmp_path / "Show" / "Season 1"
+    season.mkdir(parents=True)
+    pending = season / "Ep1.mkv"
+    skipped = season / "Ep2.mkv"
+    main.known_files.update({pending, skipped})
+    main.pending_files.add(pending)
+    main.skipped_paths.add(skipped)
+    main.total_files.set(3)
+    main.total_files_to_process.set(1)
+    main.total_files_skipped.set(1)
+
+    main.forget_path(tmp_path / "Show")
+
+    assert main.known_files == {library}
+    assert main.pending_files == set()
+    assert main.skipped_paths == set()
+    assert gauge(main.total_files) == 1
+    assert gauge(main.total_files_skipped) == 0
+    assert gauge(main.total_files_transcoded) == 1
+
+
+# --- transcode failures --------------------------------------------------
+
+
+def test_failed_transcode_reports_failure_and_removes_partial_output(
+    db, library, monkeypatch
+):
+    output = library.with_name(main._output_name(library.stem))
+
+    def fail(input_path, output_path, slot=0):
+        Path(output_path).write_bytes(b"partial")
+        raise RuntimeError("ffmpeg crashed")
+
+    monkeypatch.setattr(main, "run_ffmpeg_vaapi", fail)
+    main.total_files_transcoded.set(0)
+    main.total_files_to_process.set(1)
+
+    assert main.process_file(library) is False
+
+    assert not output.exists()
+    assert main.in_flight == set()
+    assert gauge(main.total_files_transcoded) == 0
+    assert gauge(main.total_files_to_process) == 1